@@ -1,37 +1,444 @@
 import warnings
-from fastapi import FastAPI, HTTPException, status
+import asyncio
+import logging
+import logging.handlers
+import queue
+from fastapi import BackgroundTasks, FastAPI, HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 import os
-from typing import List
+import json
+import bisect
+import hashlib
+import shutil
+import sqlite3
+import threading
+import time
+import itertools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
+import psycopg
+import numpy as np
+import xxhash
+import faiss
+from cachetools import LRUCache, TTLCache
 
 # LangChain components
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import OllamaEmbeddings
+from langchain_ollama import ChatOllama
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
 from langchain_postgres import PGVector
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.text_splitter import TextSplitter
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
 from fastapi.middleware.cors import CORSMiddleware
 
 # SQLAlchemy for direct DB query
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, text, event, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 
 # Suppress all warnings
 warnings.filterwarnings('ignore')
 
+# Server log; per-request messages are DEBUG, so they cost nothing at the default level
+logger = logging.getLogger("rag")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+# Handlers only enqueue records; a listener thread, started at startup, formats and
+# writes them to stderr, so async handlers never block on the stream
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+# --- OLLAMA EMBEDDINGS ---
+
+class OllamaBatchEmbeddings(Embeddings):
+    """
+    Ollama embeddings that send document texts in batches to the /api/embed endpoint,
+    instead of one /api/embeddings round trip per chunk. Batches are posted in parallel
+    and spread round-robin over all given Ollama servers.
+    Queries keep using the legacy /api/embeddings endpoint of the first server, except
+    that queries embedded concurrently from async code go to /api/embed as one batch.
+    """
+
+    # Same instructions as LangChain's OllamaEmbeddings, so vectors stay comparable
+    # with collections that were ingested before this class was introduced.
+    embed_instruction = "passage: "
+    query_instruction = "query: "
+
+    def __init__(
+        self,
+        model: str,
+        base_urls: List[str],
+        client: Optional[httpx.Client] = None,
+        timeout: float = 60,
+        keep_alive: Optional[int] = None,
+        batch_size: int = 32,
+        workers_per_server: int = 2,
+    ):
+        self.model = model
+        self.base_urls = base_urls
+        self.client = client or httpx.Client()
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.batch_size = batch_size  # Texts per /api/embed request
+        # Bounds the /api/embed requests in flight at once on each Ollama server
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers_per_server * len(base_urls)
+        )
+        # Query batches get threads of their own, so /ask doesn't queue behind the
+        # document batches of a large ingest
+        self._query_executor = ThreadPoolExecutor(max_workers=workers_per_server)
+        # Retrievers of concurrent /ask requests embed their queries within a few
+        # milliseconds of each other, so those share one request
+        self._query_batcher = MicroBatcher(
+            self._embed_query_batch, max_batch_size=32, max_wait=0.005
+        )
+
+    def _request_options(self) -> dict:
+        return {} if self.keep_alive is None else {"keep_alive": self.keep_alive}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts in parallel batches, keeping the input order."""
+        if not texts:
+            return []
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) == 1:
+            return self._embed_batch(self.base_urls[0], batches[0])
+
+        results = self._executor.map(
+            self._embed_batch, itertools.cycle(self.base_urls), batches
+        )
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def _embed_batch(self, base_url: str, texts: List[str]) -> List[List[float]]:
+        return self._embed_inputs(
+            base_url, [f"{self.embed_instruction}{text}" for text in texts]
+        )
+
+    def _embed_inputs(self, base_url: str, inputs: List[str]) -> List[List[float]]:
+        response = self.client.post(
+            f"{base_url}/api/embed",
+            json={
+                "model": self.model,
+                "input": inputs,
+                **self._request_options(),
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embeds a single query with /api/embeddings."""
+        response = self.client.post(
+            f"{self.base_urls[0]}/api/embeddings",
+            json={
+                "model": self.model,
+                "prompt": f"{self.query_instruction}{text}",
+                **self._request_options(),
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["embedding"]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embeds a query together with the other queries submitted at the same time."""
+        return await self._query_batcher.submit(text)
+
+    async def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._query_executor,
+            self._embed_inputs,
+            self.base_urls[0],
+            [f"{self.query_instruction}{text}" for text in texts],
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps another Embeddings and keeps document vectors in a SQLite table keyed by a
+    hash of the model name and chunk text, so re-ingesting known chunks only sends
+    the cache misses to Ollama. Queries are passed straight through.
+    """
+
+    _LOOKUP_BATCH_SIZE = 500  # Stay below SQLite's bound parameter limit
+
+    def __init__(self, underlying: Embeddings, model: str, path: str):
+        self.underlying = underlying
+        self.model = model
+        self._lock = threading.Lock()
+        # Every server worker opens the same file; WAL lets them read while one writes
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB)"
+            )
+
+    def _key(self, text: str) -> str:
+        return xxhash.xxh3_64_hexdigest(f"{self.model}\0{text}".encode())
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for start in range(0, len(keys), self._LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + self._LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._db.execute(
+                f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeds only the texts that are not cached yet, in a single batch."""
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            vectors = self._lookup(list(set(keys)))
+
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                misses.setdefault(key, text)
+
+        if misses:
+            new_vectors = np.asarray(
+                self.underlying.embed_documents(list(misses.values())), dtype=np.float32
+            )
+            vectors.update(zip(misses.keys(), new_vectors))
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)",
+                    [(key, vectors[key].tobytes()) for key in misses],
+                )
+
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
+
+
+# --- TEXT SPLITTING ---
+
+SENTENCE_END_CODES = np.array([ord(character) for character in ".!?"], dtype=np.uint32)
+
+
+class FastRecursiveSplitter(TextSplitter):
+    """
+    Character splitter that chunks like RecursiveCharacterTextSplitter: each chunk ends
+    at the last paragraph break that fits in chunk_size, else the last sentence end or
+    line break, else the last space, else it is cut at chunk_size and the next chunk
+    starts chunk_overlap characters before the cut. Boundaries are found with
+    vectorized numpy operations over the text's code points and looked up with
+    bisect, instead of re-splitting the text once per separator and merging
+    the pieces back together in Python.
+    """
+
+    def split_text(self, text: str) -> List[str]:
+        # One element per character, so array offsets are string offsets
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        is_space = (codes == 32) | ((codes >= 9) & (codes <= 13))
+        edges = np.diff(is_space.astype(np.int8), prepend=0, append=0)
+        # Start and end offset of every run of whitespace; a word starts after each run
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)
+        word_starts = run_ends if is_space[:1].all() else np.insert(run_ends, 0, 0)
+
+        # A run holding two newlines is a paragraph break, one holding a newline or
+        # following a sentence end is a sentence break, anything else a word break
+        newlines = np.flatnonzero(codes == 10)
+        run_newlines = np.searchsorted(newlines, run_ends) - np.searchsorted(newlines, run_starts)
+        after_sentence_end = np.isin(codes[run_starts - 1], SENTENCE_END_CODES) & (run_starts > 0)
+        paragraphs = run_starts[run_newlines >= 2].tolist()
+        sentences = run_starts[(run_newlines >= 1) | after_sentence_end].tolist()
+        # The chunk loop below takes a few lookups per chunk, which are cheaper with
+        # bisect on lists than with numpy calls on scalars
+
+        chunks = []
+        previous_end = 0
+        start = 0
+        while start < len(text):
+            if is_space[start]:
+                # Chunks start with a word, not with the whitespace before it
+                index = word_starts.searchsorted(start)
+                if index == len(word_starts) or word_starts[index] >= len(text):
+                    break
+                start = int(word_starts[index])
+
+            # Each chunk must end past the previous one, not at a boundary in the overlap
+            floor = max(start, previous_end)
+            end = start + self._chunk_size
+            if end >= len(text):
+                chunks.append(text[start:].rstrip())
+                break
+            for boundaries in (paragraphs, sentences):
+                boundary_index = bisect.bisect_right(boundaries, end) - 1
+                if boundary_index >= 0 and boundaries[boundary_index] > floor:
+                    end = boundaries[boundary_index]
+                    break
+            else:
+                word_end = max(text.rfind(space, floor + 1, end + 1) for space in " \n\t") + 1
+                if not word_end:
+                    # No boundary at all (CJK text, long URLs, base64): cut at chunk_size,
+                    # and let the next chunk overlap this one by chunk_overlap characters
+                    chunks.append(text[start:end])
+                    previous_end = end
+                    start = max(end - self._chunk_overlap, start + 1)
+                    continue
+                end = word_end
+            chunks.append(text[start:end].rstrip())
+            previous_end = end
+
+            # The next chunk starts with the first word within chunk_overlap of the end,
+            # without reaching back into the previous paragraph
+            overlap_start = max(end - self._chunk_overlap, start + 1)
+            paragraph_index = bisect.bisect_right(paragraphs, end) - 1
+            if paragraph_index >= 0:
+                overlap_start = max(overlap_start, paragraphs[paragraph_index] + 1)
+            index = word_starts.searchsorted(overlap_start)
+            start = int(word_starts[index]) if index < len(word_starts) else len(text)
+
+        return [chunk for chunk in chunks if chunk]
+
+
+# --- REQUEST BATCHING ---
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent requests and passes them to an async handler
+    in batches of up to max_batch_size, waiting at most max_wait seconds for a batch to
+    fill. The handler returns one result (or exception) per item, in order. A result
+    may also be a future, which resolves its item when it is done, so items the
+    handler answers quickly don't wait for the slowest one of their batch.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int,
+        max_wait: float,
+    ):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._loop = None
+        self._queue = None
+        self._dispatches = set()  # The loop only keeps weak references to tasks
+
+    async def submit(self, item: Any) -> Any:
+        """Queues an item and waits for its result from the next batch."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # The queue and collector task are bound to the loop they were created on
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            loop.create_task(self._collect())
+
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch in the background so the next batch can fill meanwhile
+            dispatch = self._loop.create_task(self._dispatch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        await asyncio.gather(*(
+            self._resolve(future, result) for (_, future), result in zip(batch, results)
+        ))
+
+    @staticmethod
+    async def _resolve(future, result):
+        if asyncio.isfuture(result):
+            try:
+                result = await result
+            except (Exception, asyncio.CancelledError) as e:
+                result = e
+        # The request may have been cancelled meanwhile
+        if future.done():
+            return
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
 # ---  GLOBAL OBJECTS (INITIALIZED ONCE AT STARTUP) ---
 
 # Global variables to hold shared components
+http_client = None  # Pooled HTTP/2 client for Ollama calls
 llm = None
 embeddings = None
 connection_string = None
 prompt = None
 document_chain = None
+text_splitter = None
+faiss_cache_dir = None  # Directory holding the persisted FAISS index of each collection
 engine = None  # SQLAlchemy engine
-inspector = None # SQLAlchemy inspector
-rag_chain_cache = {}
+async_engine = None  # SQLAlchemy async engine, for database calls made from async code
+# Retrieval chain of each collection, holding its FAISS index; the least recently
+# used chains are dropped so memory stays bounded as collections come and go
+rag_chain_cache = LRUCache(maxsize=128)
+# Lock of each collection whose chain is being created, so concurrent first requests
+# build its FAISS index once; a lock goes away with the last request holding it.
+rag_chain_locks = weakref.WeakValueDictionary()
+# PGVector store of each collection used by /ingest; its constructor reflects the
+# tables and upserts the collection row, which only needs to happen once.
+vector_store_cache = {}
+# Final answers keyed by (collection name, normalized question); entries expire after
+# an hour and are dropped whenever their collection is re-ingested or deleted.
+answer_cache = TTLCache(maxsize=4096, ttl=3600)
+# Retrieved documents under the same keys, so a question whose answer is not cached
+# (expired, or asked again while the first answer was generating) skips embedding
+# and search. Dropped together with the answers of the collection.
+retrieval_cache = LRUCache(maxsize=2048)
+# Bumped whenever a collection's cached data is forgotten; work started before a bump
+# (a chain being built, an answer being generated) doesn't cache its stale result.
+# forget_all_collections bumps all_collections_generation instead.
+collection_generations = {}
+all_collections_generation = 0
+# (monotonic time of the lookup, collection names) of the last /collections query
+collections_cache = (0.0, None)
+COLLECTIONS_CACHE_TTL = 30  # Seconds; ingest and delete also invalidate it
+collections_cache_generation = 0  # Bumped whenever collections_cache is cleared
+collection_change_listener = None  # Task applying other workers' ingests and deletes
 is_server_ready = False # Boolean flag to indicate server readiness
 
 # --- FASTAPI APP SETUP ---
@@ -59,76 +466,615 @@ def startup_event():
     It initializes the shared components and sets the server readiness flag.
     """
     global llm, embeddings, connection_string, prompt, document_chain, is_server_ready
-    global engine, inspector
+    global engine, async_engine, http_client, text_splitter, faiss_cache_dir
 
-    print("--- Server starting up: Initializing shared components... ---")
+    log_listener.start()
+    logger.info("--- Server starting up: Initializing shared components... ---")
 
     # Initialize Ollama models
     ollama_host = os.getenv("OLLAMA_HOST", "localhost")
     ollama_port = os.getenv("OLLAMA_PORT", "11434")
     ollama_url = f"http://{ollama_host}:{ollama_port}"
-    
-    llm = ChatOllama(model="llama3.2:1b", base_url=ollama_url)
-    embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=ollama_url)
+    # Optional comma-separated host[:port] list of Ollama servers to spread
+    # embedding batches over; defaults to the single server above.
+    ollama_hosts = os.getenv("OLLAMA_HOSTS", f"{ollama_host}:{ollama_port}")
+    ollama_urls = [
+        f"http://{host}" if ":" in host else f"http://{host}:{ollama_port}"
+        for host in (host.strip() for host in ollama_hosts.split(","))
+        if host
+    ]
+
+    # Keep-alive connection pool shared by all Ollama calls, so requests don't pay
+    # a new TCP handshake each time. ChatOllama builds its own httpx client from
+    # client_kwargs, so it gets an identically configured pool.
+    ollama_client_kwargs = {
+        "http2": True,
+        "limits": httpx.Limits(
+            max_keepalive_connections=40, max_connections=100, keepalive_expiry=30
+        ),
+    }
+    http_client = httpx.Client(**ollama_client_kwargs)
+
+    # keep_alive=-1 keeps both models loaded in Ollama instead of unloading them
+    # after 5 idle minutes, so no question pays for reloading the weights.
+    llm = ChatOllama(
+        model="llama3.2:1b",
+        base_url=ollama_url,
+        client_kwargs=ollama_client_kwargs,
+        keep_alive=-1,
+    )
+    embedding_model = "nomic-embed-text"
+    cache_dir = os.getenv("CACHE_DIR", "cache")
+    faiss_cache_dir = os.path.join(cache_dir, "faiss")
+    os.makedirs(faiss_cache_dir, exist_ok=True)
+    embeddings = CachedEmbeddings(
+        OllamaBatchEmbeddings(
+            model=embedding_model,
+            base_urls=ollama_urls,
+            client=http_client,
+            keep_alive=-1,
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+            workers_per_server=int(os.getenv("EMBED_WORKERS_PER_SERVER", "2")),
+        ),
+        model=embedding_model,
+        path=os.path.join(cache_dir, "embeddings.sqlite3"),
+    )
 
     # Get the database connection string from environment variables
     try:
         connection_string = os.environ["PG_VECTOR_DATABASE_URL"]
-        print("--- Found PG_VECTOR_DATABASE_URL environment variable. ---")
+        logger.info("--- Found PG_VECTOR_DATABASE_URL environment variable. ---")
     except KeyError:
-        print("--- FATAL ERROR: PG_VECTOR_DATABASE_URL environment variable not set. ---")
+        logger.critical("--- FATAL ERROR: PG_VECTOR_DATABASE_URL environment variable not set. ---")
         raise
 
-    # Initialize SQLAlchemy engine and inspector once
-    engine = create_engine(connection_string)
-    inspector = inspect(engine)
+    # Initialize SQLAlchemy engine once; pre-ping replaces pooled connections the
+    # database has closed, instead of failing the request that picks one up
+    engine = create_engine(connection_string, pool_size=10, pool_pre_ping=True)
+    event.listen(engine, "connect", set_hnsw_ef_search)
 
-    # Define a single, reusable prompt template
-    prompt = ChatPromptTemplate.from_template("""
-    Answer the following question based only on the provided context:
+    try:
+        ensure_vector_index()
+    except Exception as e:
+        logger.warning("Could not migrate the embedding table for ANN search: %s", e)
 
-    <context>
-    {context}
-    </context>
+    # Same database through psycopg's async driver, so endpoint queries don't block
+    # the event loop
+    async_engine = create_async_engine(
+        make_url(connection_string).set(drivername="postgresql+psycopg"),
+        pool_size=10,
+        max_overflow=20,
+    )
+    event.listen(async_engine.sync_engine, "connect", set_hnsw_ef_search)
 
-    Question: {input}
-    """)
+    # Define a single, reusable prompt template. The instructions are a fixed system
+    # message, so every prompt starts with the same tokens and Ollama can reuse their
+    # cached KV state; only the context and question are processed per request.
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "Answer the following question based only on the provided context."),
+        ("human", "<context>\n{context}\n</context>\n\nQuestion: {input}"),
+    ])
     
     # Create the 'stuff' documents chain once, as it doesn't change
     document_chain = create_stuff_documents_chain(llm, prompt)
 
-    print("--- Shared components initialized successfully. Server is ready. ---")
+    # The splitter is stateless, so a single instance serves every ingest request
+    text_splitter = FastRecursiveSplitter(chunk_size=500, chunk_overlap=50)
+
+    # Load both models into Ollama now, so the first question doesn't pay the cold start
+    try:
+        llm.invoke("ping")
+        embeddings.embed_query("ping")
+        logger.info("--- Ollama models warmed up. ---")
+    except Exception as e:
+        logger.warning("Could not warm up Ollama models: %s", e)
+
+    logger.info("--- Shared components initialized successfully. Server is ready. ---")
     # Set the readiness flag to True after successful initialization
     is_server_ready = True
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Stops the collection change listener and writes out any log records still queued."""
+    if collection_change_listener is not None:
+        collection_change_listener.cancel()
+    log_listener.stop()
+
+
+# --- CROSS-WORKER CACHE INVALIDATION ---
+
+# With several server workers, each process caches chains, answers and collection
+# lists of its own. Ingest and delete announce the changed collection on this
+# Postgres channel, and every worker, including the sender, drops what it cached.
+COLLECTION_CHANGES_CHANNEL = "rag_collection_changed"
+COLLECTION_CHANGED_QUERY = text(f"SELECT pg_notify('{COLLECTION_CHANGES_CHANNEL}', :payload)")
+
+def collection_change(collection_name: str, deleted: bool) -> dict:
+    """Bind parameters of COLLECTION_CHANGED_QUERY."""
+    return {"payload": json.dumps({"collection": collection_name, "deleted": deleted})}
+
+async def listen_for_collection_changes():
+    """Applies the collection changes announced by any server worker, reconnecting on errors."""
+    conninfo = make_url(connection_string).set(drivername="postgresql").render_as_string(
+        hide_password=False
+    )
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as connection:
+                await connection.execute(f"LISTEN {COLLECTION_CHANGES_CHANNEL}")
+                # Changes announced while no connection was listening were missed
+                forget_all_collections()
+                async for notification in connection.notifies():
+                    change = json.loads(notification.payload)
+                    forget_collection(change["collection"], deleted=change["deleted"])
+        except psycopg.Error as e:
+            logger.warning("Collection change listener disconnected, reconnecting: %s", e)
+            await asyncio.sleep(5)
+
+@app.on_event("startup")
+async def start_collection_change_listener():
+    global collection_change_listener
+    collection_change_listener = asyncio.create_task(listen_for_collection_changes())
+
+
+# --- PGVECTOR ANN INDEX ---
+
+# Candidate list size for HNSW scans in PGVector, applied to every pooled connection
+PG_HNSW_EF_SEARCH = int(os.getenv("PG_HNSW_EF_SEARCH", "100"))
+
+# (max rows, m, ef_construction): denser graphs keep recall up as the table grows
+PG_HNSW_TIERS = [
+    (100_000, 16, 64),
+    (1_000_000, 24, 100),
+    (None, 32, 128),
+]
+
+EMBEDDING_TABLE_EXISTS_QUERY = text(
+    "SELECT to_regclass('langchain_pg_embedding') IS NOT NULL"
+)
+PGVECTOR_VERSION_QUERY = text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+EMBEDDING_COLUMN_TYPE_QUERY = text("""
+    SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+    WHERE attrelid = 'langchain_pg_embedding'::regclass AND attname = 'embedding'
+""")
+EMBEDDING_DIMENSIONS_QUERY = text(
+    "SELECT vector_dims(embedding) FROM langchain_pg_embedding LIMIT 1"
+)
+EMBEDDING_ROW_ESTIMATE_QUERY = text(
+    "SELECT reltuples::bigint FROM pg_class WHERE oid = 'langchain_pg_embedding'::regclass"
+)
+VECTOR_INDEX_LOCK_QUERY = text("SELECT pg_try_advisory_lock(hashtext('langchain_pg_embedding_hnsw'))")
+VECTOR_INDEX_UNLOCK_QUERY = text("SELECT pg_advisory_unlock(hashtext('langchain_pg_embedding_hnsw'))")
+# An interrupted CREATE INDEX CONCURRENTLY leaves an index behind that is marked
+# invalid: it is kept up to date by writes but never used by queries
+HNSW_INDEXES_QUERY = text("""
+    SELECT index_class.relname, pg_index.indisvalid
+    FROM pg_index JOIN pg_class AS index_class ON index_class.oid = pg_index.indexrelid
+    WHERE pg_index.indrelid = 'langchain_pg_embedding'::regclass
+      AND index_class.relname LIKE 'langchain_pg_embedding_hnsw%'
+""")
+
+def hnsw_parameters(row_count: int) -> tuple:
+    """Returns the (m, ef_construction) tier for a table of row_count embeddings."""
+    for max_rows, m, ef_construction in PG_HNSW_TIERS:
+        if max_rows is None or row_count < max_rows:
+            return m, ef_construction
+
+def set_hnsw_ef_search(dbapi_connection, connection_record):
+    """SQLAlchemy 'connect' listener that sets hnsw.ef_search on new DB connections."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET hnsw.ef_search = {PG_HNSW_EF_SEARCH}")
+    cursor.close()
+    dbapi_connection.commit()
+
+def ensure_vector_index():
+    """
+    Idempotently migrates the embedding table for fast ANN search, so PGVector
+    similarity queries stop falling back to a sequential scan:
+    - On pgvector 0.7+, embeddings are stored as halfvec, half the bytes of a float32
+      vector, which halves the memory traffic of an HNSW graph walk. Other versions
+      keep vector, narrowed to a fixed dimension since HNSW can't index without one.
+    - An HNSW index is created with graph parameters sized to the table.
+    """
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        # Server workers starting together, or concurrent ingests, would otherwise
+        # run the same ALTER or index build at once. Whoever holds the lock does the
+        # work for everyone; waiting on it instead could deadlock, since CREATE INDEX
+        # CONCURRENTLY waits for every transaction that could use the table.
+        if not connection.execute(VECTOR_INDEX_LOCK_QUERY).scalar():
+            logger.debug("--- Embedding table migration already running elsewhere, skipping ---")
+            return
+        try:
+            migrate_embedding_table(connection)
+        finally:
+            connection.execute(VECTOR_INDEX_UNLOCK_QUERY)
+
+def migrate_embedding_table(connection):
+    """Runs the steps of ensure_vector_index on an autocommit connection."""
+    if not connection.execute(EMBEDDING_TABLE_EXISTS_QUERY).scalar():
+        return
+
+    version = connection.execute(PGVECTOR_VERSION_QUERY).scalar()
+    use_halfvec = tuple(int(part) for part in version.split(".")[:2]) >= (0, 7)
+    column_type = "halfvec" if use_halfvec else "vector"
+
+    current_type = connection.execute(EMBEDDING_COLUMN_TYPE_QUERY).scalar()
+    if not current_type.startswith(f"{column_type}("):
+        dimensions = connection.execute(EMBEDDING_DIMENSIONS_QUERY).scalar()
+        if dimensions is None:
+            return
+        # Indexes built for the old type can't be carried over to the new one
+        for index_name, _ in connection.execute(HNSW_INDEXES_QUERY).all():
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        new_type = f"{column_type}({int(dimensions)})"
+        connection.execute(text(
+            f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding "
+            f"TYPE {new_type} USING embedding::{new_type}"
+        ))
+
+    # The index name records type and tier, so outgrowing a tier builds a denser
+    # index next to the old one, which is dropped once the new one is valid.
+    # CONCURRENTLY keeps the table readable and writable during both steps.
+    row_count = connection.execute(EMBEDDING_ROW_ESTIMATE_QUERY).scalar()
+    m, ef_construction = hnsw_parameters(max(row_count, 0))
+    index_name = f"langchain_pg_embedding_hnsw_{column_type}_m{m}_idx"
+    if dict(connection.execute(HNSW_INDEXES_QUERY).all()).get(index_name) is False:
+        # IF NOT EXISTS would keep the invalid leftover of an interrupted build
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+    connection.execute(text(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+        f"ON langchain_pg_embedding USING hnsw (embedding {column_type}_cosine_ops) "
+        f"WITH (m = {m}, ef_construction = {ef_construction})"
+    ))
+    indexes = dict(connection.execute(HNSW_INDEXES_QUERY).all())
+    if not indexes.get(index_name):
+        return
+    for old_index_name in indexes:
+        if old_index_name != index_name:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {old_index_name}"))
+
+
+# --- IN-PROCESS FAISS INDEX ---
+
+# HNSW graph parameters for the in-process FAISS index. efSearch trades recall for
+# query latency and can be tuned per deployment.
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_CONSTRUCTION = 200
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+
+# Collections with at least this many vectors store them as 8-bit scalar-quantized
+# codes (4x less memory than float32). Smaller ones keep full precision, since the
+# quantizer's per-dimension ranges are learned from the vectors themselves.
+FAISS_SQ8_MIN_VECTORS = int(os.getenv("FAISS_SQ8_MIN_VECTORS", "10000"))
+
+# Collections with at least this many vectors use an IVF index with product-quantized
+# codes: FAISS_PQ_M sub-vectors of 8 bits each, 96 bytes per 768-dim vector (32x less
+# than float32). A query scans the FAISS_IVF_NPROBE inverted lists closest to it.
+FAISS_IVFPQ_MIN_VECTORS = int(os.getenv("FAISS_IVFPQ_MIN_VECTORS", "200000"))
+FAISS_PQ_M = 96
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+
+# Larger collections are searched in pgvector instead of being mirrored in memory;
+# at 768 dimensions, a million vectors take about 3 GB as float32 (0.8 GB as SQ8).
+# Every server worker holds its own copy, so by default a million vectors per host
+# are split among the WEB_CONCURRENCY workers.
+FAISS_MAX_VECTORS = int(os.getenv(
+    "FAISS_MAX_VECTORS", str(1_000_000 // max(int(os.getenv("WEB_CONCURRENCY", "1")), 1))
+))
+
+# Rows fetched from PGVector at a time while building a FAISS index
+FAISS_BUILD_FETCH_SIZE = 1000
+
+# FAISS has no GPU implementation of HNSW, so on hosts with a CUDA device the index
+# is an exact flat scan, which GPUs run faster than a CPU graph search.
+FAISS_USE_GPU = faiss.get_num_gpus() > 0
+
+COLLECTION_FINGERPRINT_QUERY = text("""
+    SELECT c.uuid, count(e.id), md5(string_agg(e.id, ',' ORDER BY e.id))
+    FROM langchain_pg_collection c
+    LEFT JOIN langchain_pg_embedding e ON e.collection_id = c.uuid
+    WHERE c.name = :coll_name
+    GROUP BY c.uuid
+""")
+COLLECTION_EMBEDDINGS_QUERY = text("""
+    SELECT e.id, e.document, e.cmetadata, e.embedding::text
+    FROM langchain_pg_embedding e
+    JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+    WHERE c.name = :coll_name
+""")
+
+def set_faiss_search_parameters(index):
+    """Applies the configured search-time parameters; they aren't saved with an index."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    if hasattr(index, "nprobe"):
+        index.nprobe = FAISS_IVF_NPROBE
+
+def read_collection_embeddings(collection_name: str, connection, row_count: int) -> tuple:
+    """
+    Reads every embedding of a collection from PGVector as a (vectors, documents)
+    pair, vectors being a float32 matrix with one row per document. row_count is the
+    number of embeddings in the connection's snapshot.
+    """
+    # Rows are streamed from a server-side cursor and each vector is parsed into one
+    # contiguous matrix as it arrives, so the text form of the vectors (several times
+    # their size) is never held all at once
+    result = connection.execution_options(
+        stream_results=True, yield_per=FAISS_BUILD_FETCH_SIZE
+    ).execute(COLLECTION_EMBEDDINGS_QUERY, {"coll_name": collection_name})
+    vectors = None
+    documents = []
+    for row in result:
+        vector = np.fromstring(row[3][1:-1], dtype=np.float32, sep=",")
+        if vectors is None:
+            vectors = np.empty((row_count, len(vector)), dtype=np.float32)
+        vectors[len(documents)] = vector
+        documents.append(Document(id=row[0], page_content=row[1], metadata=row[2] or {}))
+    return (vectors[:len(documents)] if documents else None), documents
+
+def build_faiss_store(vectors: np.ndarray, documents: List[Document]) -> FAISS:
+    """
+    Builds an in-process FAISS HNSW index over a collection's embeddings, so retrieval
+    is a log(N) graph search instead of a full scan in the database. FAISS normalizes,
+    trains and adds the whole matrix in single vectorized calls instead of per document.
+    """
+    dimension = vectors.shape[1]
+    faiss.normalize_L2(vectors)
+
+    # Vectors are unit-normalized, so inner product equals cosine similarity (the
+    # ranking PGVector uses) and skips the squared-norm term of an L2 distance.
+    if len(vectors) >= FAISS_IVFPQ_MIN_VECTORS and dimension % FAISS_PQ_M == 0:
+        nlist = max(20, int(2 * np.sqrt(len(vectors))))
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatIP(dimension), dimension, nlist, FAISS_PQ_M, 8,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+    elif FAISS_USE_GPU:
+        index = faiss.IndexFlatIP(dimension)
+    elif len(vectors) >= FAISS_SQ8_MIN_VECTORS:
+        index = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_8bit, FAISS_HNSW_M,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+    else:
+        index = faiss.IndexHNSWFlat(dimension, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+    set_faiss_search_parameters(index)
+
+    # FAISS samples the training set down itself when it is larger than needed
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    docstore = InMemoryDocstore({document.id: document for document in documents})
+    index_to_docstore_id = {i: document.id for i, document in enumerate(documents)}
+
+    # normalize_L2 normalizes each query vector before searching
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        normalize_L2=True,
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
+    return vector_store
+
+
+def faiss_index_path(collection_name: str) -> str:
+    collection_hash = hashlib.sha256(collection_name.encode()).hexdigest()[:16]
+    return os.path.join(faiss_cache_dir, collection_hash)
+
+def load_faiss_store(collection_name: str) -> Optional[FAISS]:
+    """
+    Returns the FAISS store of a collection, loading it from disk if the saved index
+    still matches the collection's contents, and otherwise building it from PGVector
+    and saving it. This way a restart doesn't re-read every vector from the database.
+    Returns None if the collection is empty or has more than FAISS_MAX_VECTORS vectors.
+    """
+    path = faiss_index_path(collection_name)
+    key_file = os.path.join(path, "key")
+
+    with engine.connect() as connection:
+        # Read the fingerprint and the vectors from the same snapshot
+        connection.execution_options(isolation_level="REPEATABLE READ")
+        fingerprint = connection.execute(
+            COLLECTION_FINGERPRINT_QUERY, {"coll_name": collection_name}
+        ).first()
+        if fingerprint is None or fingerprint[1] == 0:
+            return None
+        if fingerprint[1] > FAISS_MAX_VECTORS:
+            logger.info(
+                "--- Collection %s has %d vectors, searching it in PGVector ---",
+                collection_name, fingerprint[1],
+            )
+            return None
+
+        # Any re-ingest changes the row ids; the index settings change its layout
+        key = hashlib.sha256(
+            f"{fingerprint[0]}:{fingerprint[2]}:{embeddings.model}:"
+            f"{FAISS_HNSW_M}:{FAISS_SQ8_MIN_VECTORS}:{FAISS_IVFPQ_MIN_VECTORS}:"
+            f"{FAISS_PQ_M}:{FAISS_USE_GPU}".encode()
+        ).hexdigest()
+        try:
+            with open(key_file) as f:
+                saved_key = f.read()
+        except FileNotFoundError:
+            saved_key = None
+
+        if saved_key == key:
+            logger.info("--- Loading saved FAISS index for collection: %s ---", collection_name)
+            try:
+                vector_store = FAISS.load_local(
+                    path,
+                    embeddings,
+                    allow_dangerous_deserialization=True,  # Files written by this server
+                    normalize_L2=True,
+                    distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+                )
+                set_faiss_search_parameters(vector_store.index)
+                return vector_store
+            except (OSError, RuntimeError) as e:
+                # Another server worker may have been replacing the files
+                logger.warning("Could not load saved FAISS index for %s, rebuilding it: %s", collection_name, e)
+
+        vectors, documents = read_collection_embeddings(collection_name, connection, fingerprint[1])
+
+    if not documents:
+        return None
+    # Built after the connection is closed: training and adding can take minutes on
+    # large collections, and a snapshot held that long blocks VACUUM and makes
+    # CREATE INDEX CONCURRENTLY wait for it
+    vector_store = build_faiss_store(vectors, documents)
+
+    # Saved to a directory of this process and renamed into place, so neither a
+    # reader nor another server worker ever sees a partially written index
+    staging_path = f"{path}.{os.getpid()}.tmp"
+    replaced_path = f"{path}.{os.getpid()}.old"
+    vector_store.save_local(staging_path)
+    with open(os.path.join(staging_path, "key"), "w") as f:
+        f.write(key)
+    try:
+        os.rename(path, replaced_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(staging_path, path)
+    except OSError:
+        # Another worker saved its index in between; it is just as current
+        shutil.rmtree(staging_path, ignore_errors=True)
+    shutil.rmtree(replaced_path, ignore_errors=True)
+    return vector_store
+
+def move_faiss_store_to_gpu(vector_store: FAISS):
+    """Moves the store's index to the first GPU, keeping it on the CPU on failure."""
+    try:
+        resources = faiss.StandardGpuResources()
+        options = faiss.GpuClonerOptions()
+        # GPU IVFPQ needs float16 lookup tables for more than 48 sub-quantizers
+        options.useFloat16LookupTables = True
+        vector_store.index = faiss.index_cpu_to_gpu(resources, 0, vector_store.index, options)
+        # The GPU index doesn't own its resources, so they must live as long as it does
+        vector_store.gpu_resources = resources
+    except (AttributeError, RuntimeError) as e:
+        logger.warning("Could not move FAISS index to GPU, searching on CPU: %s", e)
+
+def delete_faiss_store(collection_name: str):
+    shutil.rmtree(faiss_index_path(collection_name), ignore_errors=True)
+
 
 # --- HELPER FUNCTION FOR RAG CHAIN ---
 
-def get_rag_chain(collection_name: str):
+NO_CONTEXT_ANSWER = "I don't have enough information in this collection to answer that question."
+
+# Most tokens of retrieved context put into a prompt, since prefill time grows with
+# the prompt length. Counted as characters / 4, a close estimate for English text
+# that needs no tokenizer for the Ollama model.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+CHARS_PER_TOKEN = 4
+
+def fit_context_to_budget(inputs: dict) -> dict:
+    """
+    Keeps the retrieved documents, best match first, until the next one would exceed
+    CONTEXT_TOKEN_BUDGET. The best match is always kept.
+    """
+    remaining = CONTEXT_TOKEN_BUDGET * CHARS_PER_TOKEN
+    context = []
+    for document in inputs["context"]:
+        remaining -= len(document.page_content)
+        if remaining < 0 and context:
+            break
+        context.append(document)
+    return {**inputs, "context": context}
+
+def collection_generation(collection_name: str) -> tuple:
+    """Changes whenever the cached data of the collection is forgotten."""
+    return all_collections_generation, collection_generations.get(collection_name, 0)
+
+def cached_retriever(collection_name: str, retriever):
+    """
+    Wraps a retriever so its results are served from retrieval_cache when possible.
+    Like any non-BaseRetriever in create_retrieval_chain, it receives the chain input.
+    """
+    def retrieve(inputs: dict) -> List[Document]:
+        key = answer_cache_key(collection_name, inputs["input"])
+        documents = retrieval_cache.get(key)
+        if documents is None:
+            generation = collection_generation(collection_name)
+            documents = retriever.invoke(inputs["input"])
+            if collection_generation(collection_name) == generation:
+                retrieval_cache[key] = documents
+        return documents
+
+    async def aretrieve(inputs: dict) -> List[Document]:
+        key = answer_cache_key(collection_name, inputs["input"])
+        documents = retrieval_cache.get(key)
+        if documents is None:
+            generation = collection_generation(collection_name)
+            documents = await retriever.ainvoke(inputs["input"])
+            if collection_generation(collection_name) == generation:
+                retrieval_cache[key] = documents
+        return documents
+
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+def load_faiss_store_for_search(collection_name: str) -> Optional[FAISS]:
+    """load_faiss_store, moving the index to the GPU if there is one."""
+    vector_store = load_faiss_store(collection_name)
+    if vector_store is not None and FAISS_USE_GPU:
+        move_faiss_store_to_gpu(vector_store)
+    return vector_store
+
+async def get_rag_chain(collection_name: str):
     """
     Retrieves a RAG chain for a given collection from the cache, or creates and
     caches a new one if it doesn't exist.
     """
-    global rag_chain_cache
-    
-    if collection_name in rag_chain_cache:
-        print(f"--- Found cached chain for collection: {collection_name} ---")
-        return rag_chain_cache[collection_name]
-    
-    print(f"--- No cached chain found. Creating new chain for collection: {collection_name} ---")
+    retrieval_chain = rag_chain_cache.get(collection_name)
+    if retrieval_chain is not None:
+        logger.debug("--- Found cached chain for collection: %s ---", collection_name)
+        return retrieval_chain
+
+    lock = rag_chain_locks.get(collection_name)
+    if lock is None:
+        lock = rag_chain_locks[collection_name] = asyncio.Lock()
+    async with lock:
+        # Created by the request this one waited for
+        retrieval_chain = rag_chain_cache.get(collection_name)
+        if retrieval_chain is not None:
+            return retrieval_chain
+        return await create_rag_chain(collection_name)
+
+async def create_rag_chain(collection_name: str):
+    """Creates and caches the RAG chain of a collection for get_rag_chain."""
+    logger.info("--- No cached chain found. Creating new chain for collection: %s ---", collection_name)
     try:
-        vector_store = PGVector(
-            embeddings=embeddings,
-            collection_name=collection_name,
-            connection=connection_string,
+        generation = collection_generation(collection_name)
+        # Reading the vectors and building the index take seconds on large
+        # collections, so they run in the threadpool instead of the event loop
+        vector_store = await run_in_threadpool(load_faiss_store_for_search, collection_name)
+        if vector_store is None:
+            logger.info("--- No FAISS index for %s, querying PGVector directly ---", collection_name)
+            vector_store = PGVector(
+                embeddings=embeddings,
+                collection_name=collection_name,
+                connection=async_engine,
+            )
+        retriever = cached_retriever(collection_name, vector_store.as_retriever())
+        # Retrieval runs once; if it finds nothing, answer without calling the LLM
+        answer_chain = RunnableLambda(fit_context_to_budget) | RunnableBranch(
+            (lambda inputs: not inputs["context"], RunnableLambda(lambda _: NO_CONTEXT_ANSWER)),
+            document_chain,
         )
-        retriever = vector_store.as_retriever()
-        retrieval_chain = create_retrieval_chain(retriever, document_chain)
-        rag_chain_cache[collection_name] = retrieval_chain
-        print(f"--- Successfully cached new chain for: {collection_name} ---")
+        retrieval_chain = create_retrieval_chain(retriever, answer_chain)
+        if collection_generation(collection_name) == generation:
+            rag_chain_cache[collection_name] = retrieval_chain
+            logger.info("--- Successfully cached new chain for: %s ---", collection_name)
         return retrieval_chain
     except Exception as e:
-        print(f"Error creating RAG chain: {e}")
+        logger.error("Error creating RAG chain: %s", e)
         raise HTTPException(
             status_code=404,
             detail=f"Collection '{collection_name}' not found or could not be accessed."
@@ -136,6 +1082,91 @@ def get_rag_chain(collection_name: str):
 
 # --- API ENDPOINTS ---
 
+COLLECTION_HASHES_QUERY = text("""
+    SELECT e.id, e.cmetadata->>'hash'
+    FROM langchain_pg_embedding e
+    JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+    WHERE c.name = :coll_name
+""")
+
+# Chunks embedded and inserted per add_documents call, so peak memory for the
+# vectors and the INSERT stays bounded however large the ingested content is
+INGEST_BATCH_SIZE = 512
+
+def chunk_hash(content: str) -> str:
+    """
+    Hash of a chunk's text that ignores case and whitespace, so headers, footers and
+    other boilerplate repeated within an ingest with small formatting differences are
+    stored once.
+    """
+    return xxhash.xxh3_64_hexdigest(" ".join(content.lower().split()).encode())
+
+def update_vector_index():
+    """Background task that keeps the HNSW index in step with the embedding table."""
+    try:
+        ensure_vector_index()
+    except Exception as e:
+        # The data is stored either way; without the index PGVector just scans
+        logger.warning("Could not create the HNSW index on the embedding table: %s", e)
+
+def get_ingest_vector_store(collection_name: str) -> PGVector:
+    """Returns the cached PGVector store that /ingest writes the collection with."""
+    vector_store = vector_store_cache.get(collection_name)
+    if vector_store is None:
+        vector_store = PGVector(
+            embeddings=embeddings,
+            collection_name=collection_name,
+            connection=engine,
+        )
+        vector_store_cache[collection_name] = vector_store
+    return vector_store
+
+def store_documents(collection_name: str, new_documents: Dict[str, Document]):
+    """
+    Brings a collection in line with new_documents, keyed by the hash of their text:
+    inserts the chunks it doesn't hold yet and deletes the rows of chunks that are gone.
+    """
+    vector_store = get_ingest_vector_store(collection_name)
+    with engine.connect() as connection:
+        existing_rows = connection.execute(
+            COLLECTION_HASHES_QUERY, {"coll_name": collection_name}
+        ).all()
+
+    existing_hashes = set()
+    stale_ids = []
+    for row_id, content_hash in existing_rows:
+        # Rows from before hashing (no hash) or duplicate rows are replaced
+        if content_hash in new_documents and content_hash not in existing_hashes:
+            existing_hashes.add(content_hash)
+        else:
+            stale_ids.append(row_id)
+    documents_to_add = [
+        document for content_hash, document in new_documents.items()
+        if content_hash not in existing_hashes
+    ]
+
+    # New rows go in before stale ones are deleted, so an ingest that fails partway
+    # (Ollama down, say) leaves the collection's old content searchable
+    for start in range(0, len(documents_to_add), INGEST_BATCH_SIZE):
+        batch = documents_to_add[start:start + INGEST_BATCH_SIZE]
+        try:
+            vector_store.add_documents(batch)
+        except ValueError as e:
+            if str(e) != "Collection not found":
+                raise
+            # Another worker deleted the collection and its notification hasn't arrived
+            # yet; a new store creates the collection row again. The retried batch's
+            # vectors come from the embedding cache.
+            vector_store_cache.pop(collection_name, None)
+            vector_store = get_ingest_vector_store(collection_name)
+            vector_store.add_documents(batch)
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+    logger.info(
+        "--- Collection %s: %d chunks added, %d removed, %d unchanged ---",
+        collection_name, len(documents_to_add), len(stale_ids), len(existing_hashes),
+    )
+
 class IngestRequest(BaseModel):
     collection_name: str
     content: str
@@ -146,36 +1177,49 @@ class IngestResponse(BaseModel):
     documents_added: int
 
 @app.post("/ingest", response_model=IngestResponse)
-async def ingest_data(request: IngestRequest):
+async def ingest_data(request: IngestRequest, background_tasks: BackgroundTasks):
     """API endpoint to ingest a new data source."""
     if not is_server_ready:
         raise HTTPException(status_code=503, detail="Server is not fully initialized.")
 
-    print(f"--- Received request to ingest data into collection: {request.collection_name} ---")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    documents = text_splitter.create_documents([request.content])
+    logger.debug("--- Received request to ingest data into collection: %s ---", request.collection_name)
+    documents = await run_in_threadpool(text_splitter.create_documents, [request.content])
     
     if not documents:
         raise HTTPException(status_code=400, detail="Content could not be split into documents.")
 
-    PGVector.from_documents(
-        embedding=embeddings,
-        documents=documents,
-        collection_name=request.collection_name,
-        connection=connection_string,
-        pre_delete_collection=True,
-    )
+    # Key every chunk by a hash of its text. Only chunks the collection doesn't hold
+    # yet are embedded and inserted, and rows whose chunk is gone are deleted, so
+    # re-ingesting mostly unchanged content costs only the changed chunks. Stored rows
+    # are matched by their exact text, so a fix in case or spacing still replaces them.
+    new_documents = {}
+    seen_chunks = set()
+    for document in documents:
+        normalized_hash = chunk_hash(document.page_content)
+        if normalized_hash in seen_chunks:
+            continue
+        seen_chunks.add(normalized_hash)
+        content_hash = xxhash.xxh3_64_hexdigest(document.page_content.encode())
+        document.metadata["hash"] = content_hash
+        new_documents[content_hash] = document
 
-    if request.collection_name in rag_chain_cache:
-        del rag_chain_cache[request.collection_name]
-        print(f"--- Cleared cache for updated collection: {request.collection_name} ---")
+    # Embedding and writing the chunks take a while, so they run in the threadpool
+    # while this worker keeps answering questions
+    await run_in_threadpool(store_documents, request.collection_name, new_documents)
 
-    print(f"--- Successfully ingested {len(documents)} documents into {request.collection_name} ---")
+    # Index builds can take minutes, so they run in the threadpool after the response
+    background_tasks.add_task(update_vector_index)
+
+    forget_collection(request.collection_name)
+    async with async_engine.begin() as connection:
+        await connection.execute(COLLECTION_CHANGED_QUERY, collection_change(request.collection_name, deleted=False))
+
+    logger.info("--- Successfully ingested %d documents into %s ---", len(new_documents), request.collection_name)
     
     return IngestResponse(
         message="Data ingested successfully.",
         collection_name=request.collection_name,
-        documents_added=len(documents)
+        documents_added=len(new_documents)
     )
 
 class QuestionRequest(BaseModel):
@@ -185,41 +1229,162 @@ class QuestionRequest(BaseModel):
 class AnswerResponse(BaseModel):
     answer: str
 
+def answer_cache_key(collection_name: str, question: str) -> tuple:
+    return collection_name, question.strip().lower()
+
+def clear_answer_cache(collection_name: str):
+    """Drops every cached answer and retrieval result of a collection."""
+    for cache in (answer_cache, retrieval_cache):
+        for key in [key for key in cache if key[0] == collection_name]:
+            cache.pop(key, None)
+
+async def answer_question(collection_name: str, question: str) -> str:
+    cache_key = answer_cache_key(collection_name, question)
+    # One lookup, since a TTLCache entry can expire between a check and a read
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        return cached_answer
+
+    generation = collection_generation(collection_name)
+    retrieval_chain = await get_rag_chain(collection_name=collection_name)
+    response = await retrieval_chain.ainvoke({"input": question})
+    # An answer generated from the collection's old content isn't cached
+    if collection_generation(collection_name) == generation:
+        answer_cache[cache_key] = response['answer']
+    return response['answer']
+
+async def answer_questions(requests: List[QuestionRequest]) -> List[asyncio.Task]:
+    """
+    Answers a batch of questions concurrently, so Ollama can process them together.
+    Identical questions to the same collection within a batch are answered once.
+    Returns a task per question, so each request gets its answer as soon as it is
+    ready instead of when the whole batch is.
+    """
+    answers = {}
+    for request in requests:
+        key = answer_cache_key(request.collection_name, request.question)
+        if key not in answers:
+            answers[key] = asyncio.ensure_future(
+                answer_question(request.collection_name, request.question)
+            )
+    return [
+        answers[answer_cache_key(request.collection_name, request.question)]
+        for request in requests
+    ]
+
+# Concurrent /ask requests arriving within 2 ms of each other are answered as one batch
+ask_batcher = MicroBatcher(answer_questions, max_batch_size=8, max_wait=0.002)
+
 @app.post("/ask", response_model=AnswerResponse)
 async def ask_question(request: QuestionRequest):
     """API endpoint to ask a question to a specific data source (collection)."""
     if not is_server_ready:
         raise HTTPException(status_code=503, detail="Server is not fully initialized.")
 
-    print(f"--- Received question for collection '{request.collection_name}': {request.question} ---")
-    retrieval_chain = get_rag_chain(collection_name=request.collection_name)
-    response = retrieval_chain.invoke({"input": request.question})
-    print(f"--- Generated answer: {response['answer']} ---")
-    return AnswerResponse(answer=response['answer'])
+    logger.debug("--- Received question for collection '%s': %s ---", request.collection_name, request.question)
+    answer = await ask_batcher.submit(request)
+    logger.debug("--- Generated answer: %s ---", answer)
+    return AnswerResponse(answer=answer)
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    API endpoint to ask a question and receive the answer as server-sent events, one
+    event per generated token, so clients can render it before generation finishes.
+    """
+    if not is_server_ready:
+        raise HTTPException(status_code=503, detail="Server is not fully initialized.")
+
+    logger.debug("--- Received streaming question for collection '%s': %s ---", request.collection_name, request.question)
+    cache_key = answer_cache_key(request.collection_name, request.question)
+    cached_answer = answer_cache.get(cache_key)
+    generation = collection_generation(request.collection_name)
+    # Resolve the chain before streaming starts, so a missing collection is still a 404
+    if cached_answer is None:
+        retrieval_chain = await get_rag_chain(collection_name=request.collection_name)
+
+    async def stream_tokens():
+        if cached_answer is not None:
+            yield f"data: {json.dumps({'token': cached_answer})}\n\n"
+        else:
+            tokens = []
+            async for chunk in retrieval_chain.astream({"input": request.question}):
+                if chunk.get("answer"):
+                    tokens.append(chunk['answer'])
+                    yield f"data: {json.dumps({'token': chunk['answer']})}\n\n"
+            if collection_generation(request.collection_name) == generation:
+                answer_cache[cache_key] = "".join(tokens)
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(stream_tokens(), media_type="text/event-stream")
+
+COLLECTION_TABLE_EXISTS_QUERY = text(
+    "SELECT to_regclass('langchain_pg_collection') IS NOT NULL"
+)
+COLLECTION_NAMES_QUERY = text("SELECT name FROM langchain_pg_collection")
+COLLECTION_UUID_QUERY = text("SELECT uuid FROM langchain_pg_collection WHERE name = :coll_name")
+DELETE_COLLECTION_EMBEDDINGS_QUERY = text(
+    "DELETE FROM langchain_pg_embedding WHERE collection_id = :coll_id"
+)
+DELETE_COLLECTION_QUERY = text("DELETE FROM langchain_pg_collection WHERE uuid = :coll_id")
+
+def clear_collections_cache():
+    global collections_cache, collections_cache_generation
+    collections_cache = (0.0, None)
+    collections_cache_generation += 1
+
+def forget_collection(collection_name: str, deleted: bool = False):
+    """Drops everything this worker cached for a collection that was changed."""
+    collection_generations[collection_name] = collection_generations.get(collection_name, 0) + 1
+    if rag_chain_cache.pop(collection_name, None) is not None:
+        logger.debug("--- Cleared cache for changed collection: %s ---", collection_name)
+    if deleted:
+        # Its collection row is gone, so a new ingest must create it again
+        vector_store_cache.pop(collection_name, None)
+    clear_answer_cache(collection_name)
+    clear_collections_cache()
+
+def forget_all_collections():
+    global all_collections_generation
+    all_collections_generation += 1
+    rag_chain_cache.clear()
+    vector_store_cache.clear()
+    answer_cache.clear()
+    retrieval_cache.clear()
+    clear_collections_cache()
 
 @app.get("/collections", response_model=List[str])
 async def list_collections():
     """
     API endpoint to list all available collections (data sources) in the vector store.
+    The list only changes on ingest or delete, so it is served from memory for up to
+    COLLECTIONS_CACHE_TTL seconds between those.
     """
+    global collections_cache
     if not is_server_ready:
         raise HTTPException(status_code=503, detail="Server is not fully initialized.")
-    
+
+    cached_at, cached_collections = collections_cache
+    if cached_collections is not None and time.monotonic() - cached_at < COLLECTIONS_CACHE_TTL:
+        return cached_collections
+
+    generation = collections_cache_generation
     try:
-        collection_table_name = "langchain_pg_collection"
-        if not inspector.has_table(collection_table_name):
-            print(f"--- Collection table '{collection_table_name}' does not exist. Returning empty list. ---")
-            return []
+        async with async_engine.connect() as connection:
+            if not (await connection.execute(COLLECTION_TABLE_EXISTS_QUERY)).scalar():
+                logger.debug("--- Collection table does not exist. Returning empty list. ---")
+                return []
 
-        with engine.connect() as connection:
-            query = text(f"SELECT name FROM {collection_table_name}")
-            result = connection.execute(query)
+            result = await connection.execute(COLLECTION_NAMES_QUERY)
             collections = [row[0] for row in result]
         
-        print(f"--- Found collections: {collections} ---")
+        logger.debug("--- Found collections: %s ---", collections)
+        # A list read before an ingest or delete that happened meanwhile isn't cached
+        if collections_cache_generation == generation:
+            collections_cache = (time.monotonic(), collections)
         return collections
     except Exception as e:
-        print(f"Error listing collections: {e}")
+        logger.error("Error listing collections: %s", e)
         raise HTTPException(status_code=500, detail="Failed to retrieve collections from the database.")
 
 # --- UPDATED ENDPOINT TO DELETE A COLLECTION ---
@@ -232,16 +1397,12 @@ async def delete_collection(collection_name: str):
     if not is_server_ready:
         raise HTTPException(status_code=503, detail="Server is not fully initialized.")
 
-    print(f"--- Received request to delete collection: {collection_name} ---")
-    
-    collection_table = "langchain_pg_collection"
-    embedding_table = "langchain_pg_embedding"
+    logger.debug("--- Received request to delete collection: %s ---", collection_name)
 
     try:
-        with engine.begin() as connection:  # Begins a transaction
+        async with async_engine.begin() as connection:  # Begins a transaction
             # 1. Find the UUID of the collection to be deleted
-            find_query = text(f"SELECT uuid FROM {collection_table} WHERE name = :coll_name")
-            result = connection.execute(find_query, {"coll_name": collection_name}).first()
+            result = (await connection.execute(COLLECTION_UUID_QUERY, {"coll_name": collection_name})).first()
             
             if not result:
                 raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found.")
@@ -249,24 +1410,23 @@ async def delete_collection(collection_name: str):
             collection_uuid = result[0]
             
             # 2. Delete all embeddings associated with that collection UUID
-            delete_embeddings_query = text(f"DELETE FROM {embedding_table} WHERE collection_id = :coll_id")
-            connection.execute(delete_embeddings_query, {"coll_id": collection_uuid})
+            await connection.execute(DELETE_COLLECTION_EMBEDDINGS_QUERY, {"coll_id": collection_uuid})
             
             # 3. Delete the collection's entry from the management table
-            delete_collection_query = text(f"DELETE FROM {collection_table} WHERE uuid = :coll_id")
-            connection.execute(delete_collection_query, {"coll_id": collection_uuid})
+            await connection.execute(DELETE_COLLECTION_QUERY, {"coll_id": collection_uuid})
+            # Delivered to the other server workers when the transaction commits
+            await connection.execute(COLLECTION_CHANGED_QUERY, collection_change(collection_name, deleted=True))
 
-        # 4. Also remove the chain from the in-memory cache if it exists
-        if collection_name in rag_chain_cache:
-            del rag_chain_cache[collection_name]
-            print(f"--- Cleared cache for deleted collection: {collection_name} ---")
+        # 4. Also remove the chain and everything else cached for it in memory
+        forget_collection(collection_name, deleted=True)
+        delete_faiss_store(collection_name)
 
-        print(f"--- Successfully deleted collection '{collection_name}' from database. ---")
+        logger.info("--- Successfully deleted collection '%s' from database. ---", collection_name)
         return
 
     except HTTPException as http_exc:
         # Re-raise HTTPException to ensure FastAPI handles it correctly
         raise http_exc
     except Exception as e:
-        print(f"An unexpected database error occurred while deleting '{collection_name}': {e}")
+        logger.error("An unexpected database error occurred while deleting '%s': %s", collection_name, e)
         raise HTTPException(status_code=500, detail="Failed to delete collection due to a database error.")
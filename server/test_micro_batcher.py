@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import server
+from server import MicroBatcher, QuestionRequest
+
+
+def test_results_are_passed_back_in_order():
+    async def double(items):
+        return [item * 2 for item in items]
+
+    async def run():
+        batcher = MicroBatcher(double, max_batch_size=8, max_wait=0.01)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert asyncio.run(run()) == [0, 2, 4, 6, 8]
+
+
+def test_exceptions_are_raised_to_their_item():
+    async def handler(items):
+        return [ValueError(item) if item == "bad" else item for item in items]
+
+    async def run():
+        batcher = MicroBatcher(handler, max_batch_size=8, max_wait=0.01)
+        return await asyncio.gather(
+            batcher.submit("good"), batcher.submit("bad"), return_exceptions=True
+        )
+
+    good, bad = asyncio.run(run())
+    assert good == "good"
+    assert isinstance(bad, ValueError)
+
+
+def test_fast_items_dont_wait_for_their_batch(monkeypatch):
+    calls = []
+
+    async def answer_question(collection_name, question):
+        calls.append(question)
+        await asyncio.sleep(1 if question == "slow" else 0)
+        if question == "missing":
+            raise KeyError(question)
+        return question.upper()
+
+    monkeypatch.setattr(server, "answer_question", answer_question)
+
+    async def timed(batcher, question):
+        start = time.monotonic()
+        try:
+            answer = await batcher.submit(QuestionRequest(collection_name="c", question=question))
+        except KeyError as e:
+            answer = e
+        return answer, time.monotonic() - start
+
+    async def run():
+        batcher = MicroBatcher(server.answer_questions, max_batch_size=8, max_wait=0.01)
+        return await asyncio.gather(*(
+            timed(batcher, question) for question in ("slow", "fast", "fast", "missing")
+        ))
+
+    (slow, slow_time), (fast, fast_time), (again, again_time), (missing, missing_time) = asyncio.run(run())
+    assert (slow, fast, again) == ("SLOW", "FAST", "FAST")
+    assert isinstance(missing, KeyError)
+    assert slow_time >= 1
+    assert max(fast_time, again_time, missing_time) < 0.5
+    # Identical questions in a batch are answered once
+    assert sorted(calls) == ["fast", "missing", "slow"]
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from server import FastRecursiveSplitter
+
+
+UNIQUE_BASE = 0xF0000  # Supplementary private use area
+
+
+def unique_characters(text):
+    """
+    Replaces every character the splitter doesn't treat as a boundary with a distinct
+    code point, so each chunk can be located in the text without ambiguity.
+    """
+    return "".join(
+        character if character.isspace() or character in ".!?" else chr(UNIQUE_BASE + i)
+        for i, character in enumerate(text)
+    )
+
+
+def assert_covers_text(text, chunks):
+    """Every non-whitespace character of text must be in a chunk."""
+    covered = [False] * len(text)
+    previous_start = previous_end = 0
+    for chunk in chunks:
+        offsets = [ord(c) - UNIQUE_BASE - i for i, c in enumerate(chunk) if ord(c) >= UNIQUE_BASE]
+        if offsets:
+            start = offsets[0]
+        else:
+            # A chunk of only punctuation is looked for after the previous chunk first,
+            # then in its overlap
+            start = text.find(chunk, previous_end)
+            if start == -1:
+                start = text.find(chunk, previous_start + 1)
+        assert start >= 0 and text[start:start + len(chunk)] == chunk
+        covered[start:start + len(chunk)] = [True] * len(chunk)
+        previous_start, previous_end = start, start + len(chunk)
+    missing = [i for i, character in enumerate(text) if not character.isspace() and not covered[i]]
+    assert not missing, f"{len(missing)} characters lost, first at offset {missing[0]}"
+
+
+@pytest.mark.parametrize("text", [
+    "a" * 1200,
+    "这是中文句子。" * 200,
+    "é" * 600,
+    "word " * 10 + "x" * 1200 + " tail text",
+    "First paragraph.\n\n" + "b" * 900 + "\n\nLast one. With two sentences!",
+    "",
+    "   \n\n  ",
+])
+def test_chunks_cover_text(text):
+    text = unique_characters(text)
+    splitter = FastRecursiveSplitter(chunk_size=500, chunk_overlap=50)
+    chunks = splitter.split_text(text)
+    assert all(0 < len(chunk) <= 500 for chunk in chunks)
+    assert_covers_text(text, chunks)
+
+
+def test_chunks_cover_random_text():
+    rng = random.Random(0)
+    pieces = ["ab", "cdé", "漢字", "😀", " ", ".", "!", "\n", "\n\n", "\t", "x" * 80]
+    for chunk_size, chunk_overlap in ((500, 50), (100, 20), (37, 5)):
+        splitter = FastRecursiveSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        for _ in range(100):
+            text = unique_characters(
+                "".join(rng.choice(pieces) for _ in range(rng.randint(0, 400)))
+            )
+            chunks = splitter.split_text(text)
+            assert all(0 < len(chunk) <= chunk_size for chunk in chunks)
+            assert_covers_text(text, chunks)
+
+
+def test_long_runs_are_cut_like_langchain():
+    splitter = FastRecursiveSplitter(chunk_size=500, chunk_overlap=50)
+    assert [len(chunk) for chunk in splitter.split_text("a" * 1200)] == [500, 500, 300]
+    assert [len(chunk) for chunk in splitter.split_text("é" * 600)] == [500, 150]